@@ -0,0 +1,254 @@
+"""Uji beban multi-sesi untuk Inventaris Pro.
+
+Menjalankan banyak sesi Streamlit simulasi (AppTest) secara paralel terhadap
+database hasil generate, dengan campuran kunjungan Dashboard, laporan, dan
+submit transaksi. Hasilnya: throughput, latensi p50/p95/p99, jumlah lock
+SQLite yang habis waktu tunggu, dan commit yang gagal.
+
+Setiap sesi berjalan di proses sendiri karena runtime AppTest bersifat
+global per proses dan tidak aman dipakai bersamaan dari beberapa thread.
+
+Contoh:
+    python loadtest.py --sessions 8 --iterations 25 --mix dashboard=5,laporan=3,transaksi=2
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+from streamlit.testing.v1 import AppTest
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_FILES = ["streamlit_app.py", "stock.png",
+             "superadmin.png", "admin.png", "user.png"]
+PAGES = {
+    "dashboard": "Dashboard",
+    "laporan": "Laporan",
+    "transaksi": "Transaksi"
+}
+LOCK_MESSAGES = ("database is locked", "database table is locked")
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        action, _, weight = part.partition("=")
+        if action not in PAGES:
+            raise argparse.ArgumentTypeError(f"Aksi tidak dikenal: {action}")
+        mix[action] = int(weight or 1)
+    return mix
+
+
+def new_session(workdir):
+    at = AppTest.from_file(os.path.join(
+        workdir, "streamlit_app.py"), default_timeout=120)
+    at.session_state["authenticated"] = True
+    at.session_state["role"] = "superadmin"
+    at.session_state["username"] = "superadmin"
+    return at.run()
+
+
+def init_schema(workdir):
+    # Skema dibuat oleh init_db milik aplikasi sendiri
+    os.chdir(workdir)
+    new_session(workdir)
+
+
+def prepare_database(workdir, n_items, n_transactions, days, seed):
+    for name in APP_FILES:
+        if os.path.exists(os.path.join(APP_DIR, name)):
+            shutil.copy(os.path.join(APP_DIR, name), workdir)
+    run_isolated(init_schema, [workdir])
+    os.chdir(workdir)
+
+    rng = random.Random(seed)
+    conn = sqlite3.connect("database.db")
+    conn.executemany(
+        "INSERT INTO items (nama, stok, satuan, kode) VALUES (?, ?, ?, ?)",
+        [(f"Barang {i:05d}", 1_000_000, rng.choice(["pcs", "box", "rim", "lusin"]),
+          f"LT{i:08d}") for i in range(n_items)]
+    )
+    conn.execute(
+        "INSERT INTO stock_balances (location_id, item_id, stok) SELECT 1, id, stok FROM items")
+    start = date.today() - timedelta(days=days)
+    conn.executemany(
+        "INSERT INTO transactions (item_id, tipe, jumlah, tanggal, keterangan, location_id) VALUES (?, ?, ?, ?, ?, 1)",
+        ((rng.randint(1, n_items), rng.choice(["masuk", "keluar"]), rng.randint(1, 50),
+          (start + timedelta(days=rng.randrange(days))).isoformat(), "loadtest")
+         for _ in range(n_transactions))
+    )
+    conn.commit()
+    conn.close()
+    return start
+
+
+def classify(at):
+    messages = [str(e.value) for e in at.exception] + \
+        [str(e.value) for e in at.error]
+    locked = any(m in text for text in messages for m in LOCK_MESSAGES)
+    return messages, locked
+
+
+def run_action(at, action, rng, n_items, report_start):
+    at.sidebar.radio[0].set_value(PAGES[action])
+    if action == "laporan":
+        at.run()
+        at.date_input[0].set_value(report_start)
+    elif action == "transaksi":
+        at.run()
+        tipe = rng.choice(["masuk", "keluar"])
+        index = 0 if tipe == "masuk" else 1
+        barang = [s for s in at.selectbox if s.label == "Barang"][index]
+        barang.set_value(f"Barang {rng.randrange(n_items):05d}")
+        at.number_input[index].set_value(rng.randint(1, 5))
+        label = "Proses Masuk" if tipe == "masuk" else "Proses Keluar"
+        [b for b in at.button if b.label == label][0].click()
+    started = time.perf_counter()
+    at.run()
+    return time.perf_counter() - started
+
+
+def run_session(session_id, config):
+    os.chdir(config["workdir"])
+    rng = random.Random(config["seed"] + session_id)
+    actions, weights = zip(*config["mix"].items())
+    at = new_session(config["workdir"])
+    # Semua sesi mulai bersamaan setelah proses dan skrip siap
+    config["barrier"].wait()
+    started = time.time()
+    records = []
+    for _ in range(config["iterations"]):
+        action = rng.choices(actions, weights)[0]
+        try:
+            latency = run_action(at, action, rng, config["items"],
+                                 date.fromisoformat(config["report_start"]))
+            messages, locked = classify(at)
+            committed = any("berhasil" in str(s.value) for s in at.success)
+        except Exception as e:
+            latency, messages, committed = None, [str(e)], False
+            locked = any(m in str(e) for m in LOCK_MESSAGES)
+            # Sesi yang rusak dimuat ulang seperti pengguna me-refresh halaman
+            at = new_session(config["workdir"])
+        records.append({
+            "action": action,
+            "latency": latency,
+            "failed": bool(messages),
+            "locked": locked,
+            "failed_commit": action == "transaksi" and not committed
+        })
+    return started, time.time(), records
+
+
+def run_isolated(func, *iterables):
+    # Proses baru per tugas (spawn): AppTest mengganti modul __main__ sehingga
+    # proses yang sudah menjalankan aplikasi tidak bisa dipakai ulang
+    workers = len(iterables[0])
+    with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1,
+                             mp_context=multiprocessing.get_context("spawn")) as executor:
+        return list(executor.map(func, *iterables))
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarize(records, elapsed):
+    groups = defaultdict(list)
+    for record in records:
+        groups[record["action"]].append(record)
+    groups["total"] = records
+    summary = {}
+    for action, rows in groups.items():
+        latencies = [r["latency"] * 1000 for r in rows if r["latency"] is not None]
+        summary[action] = {
+            "count": len(rows),
+            "throughput": len(rows) / elapsed,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "errors": sum(r["failed"] for r in rows),
+            "lock_errors": sum(r["locked"] for r in rows),
+            "failed_commits": sum(r["failed_commit"] for r in rows)
+        }
+    return summary
+
+
+def print_summary(summary, elapsed):
+    print(f"Durasi: {elapsed:.1f} detik")
+    header = f"{'aksi':<10}{'jumlah':>8}{'ops/s':>9}{'p50 ms':>10}{'p95 ms':>10}" \
+        f"{'p99 ms':>10}{'error':>7}{'lock':>6}{'gagal':>7}"
+    print(header)
+    print("-" * len(header))
+    for action, row in summary.items():
+        print(f"{action:<10}{row['count']:>8}{row['throughput']:>9.2f}"
+              f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}"
+              f"{row['errors']:>7}{row['lock_errors']:>6}{row['failed_commits']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Uji beban multi-sesi Inventaris Pro")
+    parser.add_argument("--sessions", type=int, default=8,
+                        help="Jumlah sesi paralel")
+    parser.add_argument("--iterations", type=int, default=20,
+                        help="Jumlah aksi per sesi")
+    parser.add_argument("--mix", type=parse_mix,
+                        default=parse_mix("dashboard=5,laporan=3,transaksi=2"),
+                        help="Bobot aksi, mis. dashboard=5,laporan=3,transaksi=2")
+    parser.add_argument("--items", type=int, default=200,
+                        help="Jumlah barang di database uji")
+    parser.add_argument("--transactions", type=int, default=50_000,
+                        help="Jumlah transaksi awal di database uji")
+    parser.add_argument("--days", type=int, default=365,
+                        help="Rentang hari transaksi awal")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workdir",
+                        help="Direktori kerja (default: direktori sementara baru)")
+    parser.add_argument("--json", help="Simpan ringkasan ke file JSON")
+    args = parser.parse_args()
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    workdir = args.workdir or tempfile.mkdtemp(prefix="inventaris-loadtest-")
+    os.makedirs(workdir, exist_ok=True)
+    report_start = prepare_database(workdir, args.items, args.transactions,
+                                    args.days, args.seed)
+    manager = multiprocessing.Manager()
+    config = {
+        "barrier": manager.Barrier(args.sessions),
+        "workdir": workdir,
+        "mix": args.mix,
+        "iterations": args.iterations,
+        "items": args.items,
+        "seed": args.seed,
+        "report_start": report_start.isoformat()
+    }
+    print(f"Database uji: {os.path.join(workdir, 'database.db')}")
+
+    results = run_isolated(run_session, range(args.sessions),
+                           [config] * args.sessions)
+    manager.shutdown()
+    elapsed = max(end for _, end, _ in results) - \
+        min(start for start, _, _ in results)
+    records = [record for _, _, session in results for record in session]
+
+    summary = summarize(records, elapsed)
+    print_summary(summary, elapsed)
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,21 @@
 import streamlit as st
 import sqlite3
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 import plotly.express as px
 from datetime import datetime, timedelta
 import base64
+import copy
+import json
 import os
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from st_aggrid import AgGrid, GridOptionsBuilder
 
 # ==================================================================================
@@ -113,13 +124,204 @@ st.markdown("""
 # ==================================================================================
 
 
+# Kunci periode laporan per agregasi: (kolom generated, ekspresi SQLite).
+# Minggu mengikuti ISO 8601 (YYYY-Www) dan dihitung dari hari Kamis pada
+# minggu yang sama agar tidak bergantung pada dukungan %V/%U di SQLite.
+ISO_THURSDAY = "date(tanggal, '-3 days', 'weekday 4')"
+PERIOD_COLUMNS = {
+    "Harian": ("periode_hari", "strftime('%Y-%m-%d', tanggal)"),
+    "Mingguan": ("periode_minggu",
+                 f"strftime('%Y', {ISO_THURSDAY}) || '-W' || "
+                 f"printf('%02d', (strftime('%j', {ISO_THURSDAY}) - 1) / 7 + 1)"),
+    "Bulanan": ("periode_bulan", "strftime('%Y-%m', tanggal)"),
+    "Tahunan": ("periode_tahun", "strftime('%Y', tanggal)")
+}
+
+
+# Kolom pendamping pada indeks periode: urutan (periode, item_id) menjaga
+# pengelompokan sesuai indeks, lokasi dan transfer difilter di dalam indeks
+PERIOD_INDEX_COLUMNS = ["item_id", "location_id",
+                        "tanggal", "tipe", "jumlah", "transfer_id"]
+
+DEFAULT_LOCATION = "Gudang Utama"
+
+
+def period_key(tanggal, aggregation):
+    if aggregation == "Mingguan":
+        year, week, _ = tanggal.isocalendar()
+        return f"{year}-W{week:02d}"
+    return tanggal.strftime({
+        "Harian": "%Y-%m-%d",
+        "Bulanan": "%Y-%m",
+        "Tahunan": "%Y"
+    }[aggregation])
+
+
+DB_PATH = 'database.db'
+
+
 @st.cache_resource
 def get_db():
-    return sqlite3.connect('database.db', check_same_thread=False)
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    # WAL: pembaca laporan tidak memblokir penulis dan sebaliknya
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+# Tipe data ringkas untuk kolom yang berulang di semua halaman; kolom lain
+# mengikuti hasil pandas
+COMPACT_DTYPES = {
+    "nama": "category",
+    "satuan": "category",
+    "tipe": "category",
+    "lokasi": "category",
+    "stok": "int32",
+    "jumlah": "int32",
+    "total_masuk": "int32",
+    "total_keluar": "int32",
+    "tanggal": "datetime64[ns]"
+}
+
+
+INT32_MIN, INT32_MAX = -2**31, 2**31 - 1
+
+
+def compact_frame(df):
+    for column, dtype in COMPACT_DTYPES.items():
+        if column not in df:
+            continue
+        if dtype.startswith("datetime"):
+            df[column] = pd.to_datetime(df[column], format="mixed")
+        elif dtype == "int32":
+            # astype("int32") membungkus nilai di luar rentang tanpa error;
+            # total periode ledger besar bisa melewatinya, jadi tetap 64-bit
+            values = df[column]
+            fits = values.empty or (
+                values.min() >= INT32_MIN and values.max() <= INT32_MAX)
+            width = "32" if fits else "64"
+            df[column] = values.astype(
+                f"Int{width}" if values.hasnans else f"int{width}")
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
 
 
-def init_db():
-    conn = get_db()
+def load_frame(query, conn=None, params=None, chunksize=None):
+    # Semua halaman memuat data lewat sini; dengan chunksize hasilnya
+    # berupa iterator DataFrame seperti pd.read_sql
+    conn = conn or get_db()
+    if chunksize:
+        return (compact_frame(chunk) for chunk in
+                pd.read_sql(query, conn, params=params, chunksize=chunksize))
+    return compact_frame(pd.read_sql(query, conn, params=params))
+
+
+def to_arrow(df):
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+@contextmanager
+def read_snapshot(pinned=None):
+    # Laporan dibaca lewat koneksi read-only terpisah dalam satu transaksi
+    # baca WAL, sehingga semua query melihat data pada titik waktu yang sama
+    # dan tidak pernah melihat transaksi yang belum di-commit
+    if pinned:
+        yield pinned
+        return
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro",
+                           uri=True, isolation_level=None)
+    try:
+        conn.execute("BEGIN")
+        # Snapshot WAL dimulai pada pembacaan pertama di dalam transaksi
+        conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        yield conn, datetime.now()
+    finally:
+        conn.close()
+
+
+def pin_snapshot():
+    # Salinan in-memory lewat backup API agar snapshot bertahan antar rerun
+    source = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+    snapshot = sqlite3.connect(":memory:", check_same_thread=False)
+    try:
+        source.backup(snapshot)
+    finally:
+        source.close()
+    return snapshot, datetime.now()
+
+
+RENDER_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+
+@st.cache_resource
+def get_version_db():
+    # Koneksi khusus yang tidak pernah menulis: PRAGMA data_version di sini
+    # berubah setiap ada commit dari koneksi lain (aplikasi maupun proses lain)
+    return sqlite3.connect(DB_PATH, check_same_thread=False)
+
+
+def data_version():
+    return get_version_db().execute("PRAGMA data_version").fetchone()[0]
+
+
+@st.cache_resource
+def get_render_cache():
+    # Cache bersama untuk figure Plotly dan gridOptions AgGrid yang sudah
+    # jadi, dengan batas memori dan eviction LRU
+    return {"lock": threading.Lock(), "entries": OrderedDict(), "bytes": 0}
+
+
+def render_size(value):
+    if hasattr(value, "to_json"):
+        return len(value.to_json())
+    return len(json.dumps(value, default=str))
+
+
+def cached_render(page, params, build, version=None):
+    key = (page, params, data_version() if version is None else version)
+    cache = get_render_cache()
+    entries = cache["entries"]
+    with cache["lock"]:
+        if key in entries:
+            entries.move_to_end(key)
+            return entries[key][0]
+    value = build()
+    size = render_size(value)
+    with cache["lock"]:
+        if key not in entries and size <= RENDER_CACHE_MAX_BYTES:
+            entries[key] = (value, size)
+            cache["bytes"] += size
+            while cache["bytes"] > RENDER_CACHE_MAX_BYTES:
+                _, (_, evicted) = entries.popitem(last=False)
+                cache["bytes"] -= evicted
+    return value
+
+
+def toggle_snapshot_pin():
+    snapshot = st.session_state.pop("laporan_snapshot", None)
+    if snapshot:
+        snapshot[0].close()
+    if st.session_state.laporan_pin:
+        st.session_state.laporan_snapshot = pin_snapshot()
+    # Saldo awal kartu stok dihitung ulang dari snapshot yang baru
+    st.session_state.pop("kartu_stok_key", None)
+
+
+def snapshot_pin_control(snapshot_at):
+    pinned = "laporan_snapshot" in st.session_state
+    col1, col2 = st.columns([3, 1])
+    col1.caption(f"📸 Snapshot data: {snapshot_at:%d %b %Y %H:%M:%S}"
+                 + (" (dikunci)" if pinned else ""))
+    # State toggle hilang saat pindah halaman, snapshot tidak; nilainya
+    # selalu diturunkan dari snapshot yang tersimpan
+    st.session_state.laporan_pin = pinned
+    col2.toggle("Kunci snapshot", key="laporan_pin",
+                on_change=toggle_snapshot_pin,
+                help="Laporan dan export tetap memakai data pada waktu snapshot")
+
+
+def init_db(conn=None):
+    conn = conn or get_db()
     c = conn.cursor()
     c.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -135,9 +337,16 @@ def init_db():
             nama TEXT UNIQUE NOT NULL,
             stok INTEGER NOT NULL,
             satuan TEXT NOT NULL,
-            keterangan TEXT
+            keterangan TEXT,
+            kode TEXT
         )
     ''')
+    # Migrasi kolom kode (barcode/SKU) untuk database lama
+    columns = [row[1] for row in c.execute("PRAGMA table_info(items)")]
+    if 'kode' not in columns:
+        c.execute("ALTER TABLE items ADD COLUMN kode TEXT")
+    c.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_items_kode ON items(kode)")
     c.execute('''
         CREATE TABLE IF NOT EXISTS transactions (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -146,14 +355,283 @@ def init_db():
             jumlah INTEGER NOT NULL,
             tanggal DATE NOT NULL,
             keterangan TEXT,
+            location_id INTEGER NOT NULL DEFAULT 1,
+            transfer_id INTEGER,
+            FOREIGN KEY(item_id) REFERENCES items(id),
+            FOREIGN KEY(location_id) REFERENCES locations(id)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS locations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nama TEXT UNIQUE NOT NULL
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS stock_balances (
+            location_id INTEGER NOT NULL,
+            item_id INTEGER NOT NULL,
+            stok INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(location_id, item_id),
+            FOREIGN KEY(location_id) REFERENCES locations(id),
             FOREIGN KEY(item_id) REFERENCES items(id)
         )
     ''')
+    c.execute("SELECT id FROM locations WHERE id=1")
+    if not c.fetchone():
+        c.execute("INSERT INTO locations (id, nama) VALUES (1, ?)",
+                  (DEFAULT_LOCATION,))
+    # Migrasi multi-lokasi: transaksi dan stok lama masuk ke lokasi default
+    columns = [row[1]
+               for row in c.execute("PRAGMA table_xinfo(transactions)")]
+    if 'location_id' not in columns:
+        c.execute(
+            "ALTER TABLE transactions ADD COLUMN location_id INTEGER NOT NULL DEFAULT 1 REFERENCES locations(id)")
+        c.execute("ALTER TABLE transactions ADD COLUMN transfer_id INTEGER")
+        c.execute(
+            "INSERT OR IGNORE INTO stock_balances (location_id, item_id, stok) SELECT 1, id, stok FROM items")
+        columns += ['location_id', 'transfer_id']
+    # Kolom periode dihitung saat tulis dan diindeks (covering) agar laporan
+    # bisa dikelompokkan mengikuti urutan indeks tanpa strftime per baris
+    for column, expression in PERIOD_COLUMNS.values():
+        if column not in columns:
+            c.execute(f"""
+                ALTER TABLE transactions ADD COLUMN {column} TEXT
+                GENERATED ALWAYS AS ({expression}) VIRTUAL
+            """)
+        index = f"idx_transactions_{column}"
+        index_columns = [row[2]
+                         for row in c.execute(f"PRAGMA index_info({index})")]
+        if index_columns != [column] + PERIOD_INDEX_COLUMNS:
+            c.execute(f"DROP INDEX IF EXISTS {index}")
+            c.execute(f"""
+                CREATE INDEX {index} ON transactions(
+                    {column}, {", ".join(PERIOD_INDEX_COLUMNS)}
+                )
+            """)
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_transactions_lokasi ON transactions(location_id, tanggal)")
+    # Aktivitas terakhir Dashboard (semua lokasi): ORDER BY tanggal DESC LIMIT
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_transactions_tanggal ON transactions(tanggal)")
+    # Jalur akses kartu stok: urut (item_id, tanggal, id) dan covering untuk
+    # saldo berjalan, sehingga hanya keterangan yang dibaca dari tabel
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_transactions_item_tanggal ON transactions(
+            item_id, tanggal, id, tipe, jumlah, location_id, transfer_id
+        )
+    """)
     c.execute("SELECT * FROM users WHERE username='superadmin'")
     if not c.fetchone():
         c.execute(
             "INSERT INTO users (username, password, role) VALUES ('superadmin', 'superadmin123', 'superadmin')")
+    conn.commit()
+
+
+def get_locations(conn=None):
+    return load_frame("SELECT id, nama FROM locations ORDER BY id", conn)
+
+
+def select_location(label, key=None, container=st, include_all=False,
+                    conn=None):
+    locations = get_locations(conn)
+    names = dict(zip(locations['id'].tolist(), locations['nama']))
+    options = ([None] if include_all else []) + list(names)
+    return container.selectbox(
+        label, options, key=key,
+        format_func=lambda x: "Semua Lokasi" if x is None else names[x])
+
+
+def get_location_stock(c, item_id, location_id):
+    c.execute("SELECT stok FROM stock_balances WHERE location_id=? AND item_id=?",
+              (location_id, item_id))
+    row = c.fetchone()
+    return row[0] if row else 0
+
+
+class InsufficientStock(Exception):
+    pass
+
+
+def record_movement(c, item_id, location_id, tipe, jumlah, tanggal, keterangan,
+                    update_total=True):
+    # Saldo lokasi diubah lebih dulu. Untuk keluar, cek stok ada di dalam
+    # UPDATE yang sama sehingga dua penulis bersamaan tidak bisa membuat
+    # saldo negatif; bila gagal belum ada baris yang ditulis
+    if tipe == 'keluar':
+        c.execute("""
+            UPDATE stock_balances SET stok = stok - ?
+            WHERE location_id = ? AND item_id = ? AND stok >= ?
+        """, (jumlah, location_id, item_id, jumlah))
+        if c.rowcount == 0:
+            raise InsufficientStock(location_id, item_id)
+    else:
+        c.execute("""
+            INSERT INTO stock_balances (location_id, item_id, stok) VALUES (?, ?, ?)
+            ON CONFLICT(location_id, item_id) DO UPDATE SET stok = stok + excluded.stok
+        """, (location_id, item_id, jumlah))
+    c.execute(
+        "INSERT INTO transactions (item_id, tipe, jumlah, tanggal, keterangan, location_id) VALUES (?, ?, ?, ?, ?, ?)",
+        (item_id, tipe, jumlah, tanggal, keterangan, location_id)
+    )
+    transaction_id = c.lastrowid
+    delta = jumlah if tipe == 'masuk' else -jumlah
+    if update_total:
+        c.execute("UPDATE items SET stok = stok + ? WHERE id = ?",
+                  (delta, item_id))
+    return transaction_id
+
+
+def transfer_stock(conn, item_id, from_location_id, to_location_id, jumlah,
+                   tanggal, keterangan):
+    # Keluar dan masuk dicatat dalam satu commit; transfer_id menautkan
+    # keduanya dan stok total barang tidak berubah
+    c = conn.cursor()
+    try:
+        keluar_id = record_movement(c, item_id, from_location_id, 'keluar', jumlah,
+                                    tanggal, keterangan, update_total=False)
+        masuk_id = record_movement(c, item_id, to_location_id, 'masuk', jumlah,
+                                   tanggal, keterangan, update_total=False)
+        c.execute("UPDATE transactions SET transfer_id = ? WHERE id IN (?, ?)",
+                  (keluar_id, keluar_id, masuk_id))
         conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+# ==================================================================================
+# ANTRIAN SCAN (WRITE-BEHIND)
+# ==================================================================================
+
+
+SCAN_FLUSH_SIZE = 50       # Jumlah scan maksimum sebelum ditulis ke database
+SCAN_FLUSH_INTERVAL = 2    # Detik maksimum scan tertahan di antrian
+SCAN_LOCK_TIMEOUT = 30     # Detik menunggu lock tulis SQLite saat flush
+
+
+@st.cache_resource
+def get_scan_queue():
+    # Antrian bersama untuk semua sesi: scan digabung per (lokasi, barang, tipe)
+    # lalu ditulis dalam satu transaksi (group commit). Koneksinya terpisah
+    # dari get_db() agar commit/rollback flush tidak ikut menutup transaksi
+    # form yang sedang berjalan di sesi lain. "lock" hanya menjaga struktur
+    # antrian; penulisan ke database berjalan di luarnya sehingga scan tetap
+    # diterima selama flush menunggu lock tulis SQLite
+    queue = {
+        "lock": threading.Lock(),
+        "flush_lock": threading.Lock(),
+        "wake": threading.Event(),
+        "conn": sqlite3.connect(DB_PATH, timeout=SCAN_LOCK_TIMEOUT,
+                                check_same_thread=False),
+        "reader": sqlite3.connect(DB_PATH, check_same_thread=False),
+        "pending": {},
+        "in_flight": {},
+        "count": 0,
+        "error": None,
+        # Scan keluar yang sudah dikonfirmasi tapi tidak bisa dibukukan karena
+        # stok habis, per (lokasi, barang); tetap tampil sampai ditandai
+        "rejected": {}
+    }
+    threading.Thread(target=scan_flush_loop, args=(queue,),
+                     daemon=True).start()
+    return queue
+
+
+def scan_flush_loop(queue):
+    while True:
+        # Bangun tiap interval, atau lebih cepat saat antrian penuh
+        queue["wake"].wait(SCAN_FLUSH_INTERVAL)
+        queue["wake"].clear()
+        try:
+            flush_scan_queue(queue)
+        except Exception as e:
+            # Thread tidak boleh mati: flush berkala harus tetap berjalan
+            queue["error"] = str(e)
+
+
+def queued_scans(queue, key):
+    return queue["pending"].get(key, 0) + queue["in_flight"].get(key, 0)
+
+
+def enqueue_scan(queue, kode, tipe, location_id):
+    with queue["lock"]:
+        c = queue["reader"].cursor()
+        c.execute("SELECT id, nama FROM items WHERE kode=? OR nama=?",
+                  (kode, kode))
+        row = c.fetchone()
+        if not row:
+            return False, f"Kode {kode} tidak ditemukan!"
+        item_id, nama = row
+        if tipe == 'keluar':
+            sisa = get_location_stock(c, item_id, location_id) \
+                + queued_scans(queue, (location_id, item_id, 'masuk')) \
+                - queued_scans(queue, (location_id, item_id, 'keluar'))
+            if sisa < 1:
+                return False, f"Stok {nama} tidak mencukupi!"
+        key = (location_id, item_id, tipe)
+        pending = queue["pending"]
+        pending[key] = pending.get(key, 0) + 1
+        queue["count"] += 1
+        if queue["count"] >= SCAN_FLUSH_SIZE:
+            queue["wake"].set()
+    return True, f"{nama} ({tipe}) tercatat"
+
+
+def flush_scan_queue(queue):
+    # flush_lock: thread latar dan tombol "Simpan Sekarang" tidak menulis
+    # bersamaan lewat koneksi yang sama
+    with queue["flush_lock"]:
+        with queue["lock"]:
+            pending = queue["pending"]
+            if not pending:
+                return 0
+            queue["in_flight"] = pending
+            queue["pending"] = {}
+            queue["count"] = 0
+        conn = queue["conn"]
+        tanggal = datetime.now().date()
+        shortfalls = {}
+        try:
+            c = conn.cursor()
+            for (location_id, item_id, tipe), jumlah in pending.items():
+                try:
+                    record_movement(c, item_id, location_id, tipe, jumlah,
+                                    tanggal, f"Scan ({jumlah}x)")
+                except InsufficientStock:
+                    # Stok sudah dipakai transaksi lain sejak scan diterima:
+                    # sisa stok tetap dibukukan, kekurangannya dicatat. Lock
+                    # tulis sudah dipegang sehingga stok tidak berubah lagi
+                    booked = max(get_location_stock(c, item_id, location_id), 0)
+                    if booked:
+                        record_movement(c, item_id, location_id, tipe, booked,
+                                        tanggal, f"Scan ({booked}/{jumlah}x)")
+                    shortfalls[(location_id, item_id)] = jumlah - booked
+            # Lock tulis SQLite sudah dipegang, commit tidak menunggu lagi;
+            # in_flight dikosongkan bersamaan agar cek stok scan keluar tidak
+            # menghitung scan yang sama dua kali
+            with queue["lock"]:
+                conn.commit()
+                queue["in_flight"] = {}
+                queue["error"] = None
+                rejected = queue["rejected"]
+                for key, jumlah in shortfalls.items():
+                    rejected[key] = rejected.get(key, 0) + jumlah
+        except sqlite3.Error as e:
+            # Scan dikembalikan ke antrian dan dicoba lagi pada flush berikutnya
+            conn.rollback()
+            with queue["lock"]:
+                for key, jumlah in pending.items():
+                    queue["pending"][key] = queue["pending"].get(key, 0) + jumlah
+                    queue["count"] += jumlah
+                queue["in_flight"] = {}
+                queue["error"] = str(e)
+            return 0
+        return sum(pending.values()) - sum(shortfalls.values())
+
+
+def acknowledge_scan_rejections(queue):
+    with queue["lock"]:
+        queue["rejected"] = {}
 
 # ==================================================================================
 # FUNGSI PEMBANTU UNTUK GAMBAR
@@ -300,13 +778,33 @@ def render_sidebar():
 def dashboard_page():
     check_access(["superadmin", "admin", "user"])
     render_header()
-    items = pd.read_sql("SELECT * FROM items", get_db())
-    transactions = pd.read_sql("""
-        SELECT t.*, i.nama 
-        FROM transactions t 
-        JOIN items i ON t.item_id = i.id
-        ORDER BY t.tanggal DESC
-    """, get_db()).head(5)
+    location_id = select_location("Lokasi", include_all=True)
+    version = data_version()
+    if location_id is None:
+        items = load_frame("SELECT * FROM items", get_db())
+        transactions = load_frame("""
+            SELECT t.*, i.nama, l.nama AS lokasi
+            FROM transactions t
+            JOIN items i ON t.item_id = i.id
+            JOIN locations l ON t.location_id = l.id
+            ORDER BY t.tanggal DESC
+            LIMIT 5
+        """, get_db())
+    else:
+        items = load_frame("""
+            SELECT i.id, i.nama, COALESCE(b.stok, 0) AS stok, i.satuan, i.keterangan
+            FROM items i
+            LEFT JOIN stock_balances b ON b.item_id = i.id AND b.location_id = ?
+        """, get_db(), params=(location_id,))
+        transactions = load_frame("""
+            SELECT t.*, i.nama, l.nama AS lokasi
+            FROM transactions t
+            JOIN items i ON t.item_id = i.id
+            JOIN locations l ON t.location_id = l.id
+            WHERE t.location_id = ?
+            ORDER BY t.tanggal DESC
+            LIMIT 5
+        """, get_db(), params=(location_id,))
 
     # Metric Cards
     col1, col2, col3 = st.columns(3)
@@ -336,42 +834,46 @@ def dashboard_page():
     # Stok Distribution Chart
     st.subheader("Distribusi Stok Barang")
     if not items.empty:
-        fig = px.bar(
-            items,
-            x='nama',
-            y='stok',
-            title="Klik pada legenda untuk filter",
-            labels={'nama': 'Barang', 'stok': 'Jumlah Stok'},
-            color='stok',
-            color_continuous_scale='Viridis',
-            hover_data={'nama': True, 'stok': True, 'satuan': True}
-        )
-        fig.update_layout(
-            plot_bgcolor='rgba(0,0,0,0)',
-            paper_bgcolor='rgba(0,0,0,0)',
-            margin=dict(l=20, r=20, t=30, b=20),
-            xaxis_tickangle=45,
-            font=dict(size=14),
-            legend=dict(
-                orientation="h",
-                yanchor="bottom",
-                y=1.02,
-                xanchor="right",
-                x=1
-            ),
-            annotations=[
-                dict(
-                    x=0.5,
-                    y=1.15,
-                    xref="paper",
-                    yref="paper",
-                    text="Stok Minimum: 10",
-                    showarrow=False,
-                    font=dict(color="red", size=12)
-                )
-            ]
-        )
-        fig.add_hline(y=10, line_dash="dot", line_color="red")
+        def build_chart():
+            fig = px.bar(
+                items,
+                x='nama',
+                y='stok',
+                title="Klik pada legenda untuk filter",
+                labels={'nama': 'Barang', 'stok': 'Jumlah Stok'},
+                color='stok',
+                color_continuous_scale='Viridis',
+                hover_data={'nama': True, 'stok': True, 'satuan': True}
+            )
+            fig.update_layout(
+                plot_bgcolor='rgba(0,0,0,0)',
+                paper_bgcolor='rgba(0,0,0,0)',
+                margin=dict(l=20, r=20, t=30, b=20),
+                xaxis_tickangle=45,
+                font=dict(size=14),
+                legend=dict(
+                    orientation="h",
+                    yanchor="bottom",
+                    y=1.02,
+                    xanchor="right",
+                    x=1
+                ),
+                annotations=[
+                    dict(
+                        x=0.5,
+                        y=1.15,
+                        xref="paper",
+                        yref="paper",
+                        text="Stok Minimum: 10",
+                        showarrow=False,
+                        font=dict(color="red", size=12)
+                    )
+                ]
+            )
+            fig.add_hline(y=10, line_dash="dot", line_color="red")
+            return fig
+
+        fig = cached_render("dashboard", (location_id,), build_chart, version)
         st.plotly_chart(fig, use_container_width=True)
     else:
         st.warning("Tidak ada data barang", icon="⚠️")
@@ -383,10 +885,12 @@ def dashboard_page():
             lambda x: "✅ Masuk" if x == "masuk" else "❌ Keluar"
         )
         st.dataframe(
-            transactions[['tanggal', 'nama', 'status', 'jumlah']],
+            to_arrow(transactions[['tanggal', 'nama',
+                     'lokasi', 'status', 'jumlah']]),
             column_config={
                 "tanggal": st.column_config.DateColumn("Tanggal", format="DD MMM YYYY"),
                 "nama": st.column_config.TextColumn("Barang"),
+                "lokasi": st.column_config.TextColumn("Lokasi"),
                 "status": st.column_config.TextColumn("Status",
                                                       help="✅ Masuk = Penambahan stok | ❌ Keluar = Pengurangan stok",
                                                       width="medium"
@@ -409,17 +913,18 @@ def barang_page():
     render_header()
     tab1, tab2 = st.tabs(["Daftar Barang", "Tambah Barang"])
     with tab1:
-        items = pd.read_sql("SELECT * FROM items", get_db())
+        items = load_frame("SELECT * FROM items", get_db())
         if items.empty:
             st.warning("Tidak ada data barang")
         else:
             st.dataframe(
-                items,
+                to_arrow(items),
                 column_config={
                     "nama": "Nama Barang",
                     "stok": st.column_config.NumberColumn("Stok", format="%d"),
                     "satuan": "Satuan",
-                    "keterangan": "Keterangan"
+                    "keterangan": "Keterangan",
+                    "kode": "Kode/Barcode"
                 },
                 use_container_width=True,
                 height=300
@@ -431,7 +936,11 @@ def barang_page():
             nama = col1.text_input(
                 "Nama Barang*", placeholder="Contoh: Kertas A4")
             satuan = col2.selectbox("Satuan*", ["pcs", "box", "rim", "lusin"])
-            stok = st.number_input("Stok Awal*", min_value=0)
+            col3, col4 = st.columns(2)
+            stok = col3.number_input("Stok Awal*", min_value=0)
+            location_id = select_location("Lokasi Stok Awal*", container=col4)
+            kode = st.text_input(
+                "Kode/Barcode", placeholder="Contoh: 8991234567890")
             keterangan = st.text_area(
                 "Keterangan", placeholder="Catatan tambahan...")
             if st.form_submit_button("Simpan", type="primary"):
@@ -442,15 +951,23 @@ def barang_page():
                 else:
                     try:
                         conn = get_db()
-                        conn.cursor().execute(
-                            "INSERT INTO items (nama, stok, satuan, keterangan) VALUES (?, ?, ?, ?)",
-                            (nama.strip(), stok, satuan, keterangan)
+                        c = conn.cursor()
+                        c.execute(
+                            "INSERT INTO items (nama, stok, satuan, keterangan, kode) VALUES (?, ?, ?, ?, ?)",
+                            (nama.strip(), stok, satuan, keterangan,
+                             kode.strip() or None)
+                        )
+                        c.execute(
+                            "INSERT INTO stock_balances (location_id, item_id, stok) VALUES (?, ?, ?)",
+                            (location_id, c.lastrowid, stok)
                         )
                         conn.commit()
                         st.success(f"Barang {nama} berhasil ditambahkan!")
                     except sqlite3.IntegrityError:
-                        st.error("Nama barang sudah ada!")
+                        get_db().rollback()
+                        st.error("Nama atau kode barang sudah ada!")
                     except Exception as e:
+                        get_db().rollback()
                         st.error(f"Error: {str(e)}")
 
 # ==================================================================================
@@ -461,12 +978,14 @@ def barang_page():
 def transaksi_page():
     check_access(["superadmin", "admin"])
     render_header()
-    tab_masuk, tab_keluar = st.tabs(["Tambah Masuk", "Tambah Keluar"])
+    tab_masuk, tab_keluar, tab_transfer, tab_scan = st.tabs(
+        ["Tambah Masuk", "Tambah Keluar", "Transfer Lokasi", "Mode Scan"])
     with tab_masuk:
         with st.form("form_masuk", border=True):
             st.subheader("Tambah Stok Masuk")
-            item = st.selectbox("Barang", pd.read_sql(
+            item = st.selectbox("Barang", load_frame(
                 "SELECT nama FROM items", get_db())['nama'].tolist())
+            location_id = select_location("Lokasi")
             jumlah = st.number_input("Jumlah*", min_value=1)
             tanggal = st.date_input("Tanggal", value=datetime.now())
             keterangan = st.text_area("Keterangan")
@@ -474,57 +993,148 @@ def transaksi_page():
                 if not item or jumlah <= 0:
                     st.error("Lengkapi data!")
                 else:
+                    conn = get_db()
                     try:
-                        item_id = pd.read_sql(
+                        item_id = load_frame(
                             f"SELECT id FROM items WHERE nama='{item}'", get_db()).iloc[0]['id']
-                        conn = get_db()
-                        # Insert transaction
-                        conn.cursor().execute(
-                            "INSERT INTO transactions (item_id, tipe, jumlah, tanggal, keterangan) VALUES (?, ?, ?, ?, ?)",
-                            (item_id, 'masuk', jumlah, tanggal, keterangan)
-                        )
-                        # Update stock
-                        conn.cursor().execute(
-                            "UPDATE items SET stok = stok + ? WHERE id = ?",
-                            (jumlah, item_id)
-                        )
+                        record_movement(conn.cursor(), int(item_id), location_id, 'masuk',
+                                        jumlah, tanggal, keterangan)
                         conn.commit()
                         st.success(f"Stok {item} berhasil ditambahkan!")
                     except Exception as e:
+                        conn.rollback()
                         st.error(f"Gagal: {str(e)}")
     with tab_keluar:
         with st.form("form_keluar", border=True):
             st.subheader("Kurangi Stok Keluar")
-            item = st.selectbox("Barang", pd.read_sql(
+            item = st.selectbox("Barang", load_frame(
                 "SELECT nama FROM items", get_db())['nama'].tolist())
+            location_id = select_location("Lokasi")
             jumlah = st.number_input("Jumlah*", min_value=1)
             tanggal = st.date_input("Tanggal", value=datetime.now())
             keterangan = st.text_area("Keterangan")
             if st.form_submit_button("Proses Keluar", type="primary"):
-                item_data = pd.read_sql(
+                item_data = load_frame(
                     f"SELECT * FROM items WHERE nama='{item}'", get_db())
                 if item_data.empty:
                     st.error("Barang tidak ditemukan!")
-                elif item_data['stok'].values[0] < jumlah:
-                    st.error("Stok tidak mencukupi!")
                 else:
+                    conn = get_db()
                     try:
-                        item_id = item_data['id'].values[0]
-                        conn = get_db()
-                        # Insert transaction
-                        conn.cursor().execute(
-                            "INSERT INTO transactions (item_id, tipe, jumlah, tanggal, keterangan) VALUES (?, ?, ?, ?, ?)",
-                            (item_id, 'keluar', jumlah, tanggal, keterangan)
-                        )
-                        # Update stock
-                        conn.cursor().execute(
-                            "UPDATE items SET stok = stok - ? WHERE id = ?",
-                            (jumlah, item_id)
-                        )
+                        item_id = int(item_data['id'].values[0])
+                        record_movement(conn.cursor(), item_id, location_id, 'keluar',
+                                        jumlah, tanggal, keterangan)
                         conn.commit()
                         st.success(f"Stok {item} berhasil dikurangi!")
+                    except InsufficientStock:
+                        conn.rollback()
+                        st.error("Stok di lokasi ini tidak mencukupi!")
                     except Exception as e:
+                        conn.rollback()
                         st.error(f"Gagal: {str(e)}")
+    with tab_transfer:
+        with st.form("form_transfer", border=True):
+            st.subheader("Transfer Antar Lokasi")
+            item = st.selectbox("Barang", load_frame(
+                "SELECT nama FROM items", get_db())['nama'].tolist())
+            col1, col2 = st.columns(2)
+            from_location_id = select_location("Dari Lokasi", container=col1)
+            to_location_id = select_location("Ke Lokasi", container=col2)
+            jumlah = st.number_input("Jumlah*", min_value=1)
+            tanggal = st.date_input("Tanggal", value=datetime.now())
+            keterangan = st.text_area("Keterangan")
+            if st.form_submit_button("Proses Transfer", type="primary"):
+                item_data = load_frame(
+                    "SELECT id FROM items WHERE nama=?", get_db(), params=(item,))
+                if item_data.empty:
+                    st.error("Barang tidak ditemukan!")
+                elif from_location_id == to_location_id:
+                    st.error("Lokasi asal dan tujuan harus berbeda!")
+                else:
+                    try:
+                        transfer_stock(get_db(), int(item_data['id'].values[0]),
+                                       from_location_id, to_location_id, jumlah,
+                                       tanggal, keterangan)
+                        st.success(f"Stok {item} berhasil ditransfer!")
+                    except InsufficientStock:
+                        st.error("Stok di lokasi asal tidak mencukupi!")
+                    except Exception as e:
+                        st.error(f"Gagal: {str(e)}")
+    with tab_scan:
+        scan_page()
+
+
+def handle_scan():
+    kode = st.session_state.scan_kode.strip()
+    st.session_state.scan_kode = ""
+    if kode:
+        st.session_state.scan_feedback = enqueue_scan(
+            get_scan_queue(), kode, st.session_state.scan_tipe,
+            st.session_state.scan_lokasi)
+
+
+@st.fragment
+def scan_page():
+    queue = get_scan_queue()
+    st.subheader("Mode Scan Cepat")
+    st.caption(
+        f"Scan ditahan maksimal {SCAN_FLUSH_INTERVAL} detik atau "
+        f"{SCAN_FLUSH_SIZE} scan, lalu disimpan sekaligus.")
+    col1, col2 = st.columns(2)
+    select_location("Lokasi", key="scan_lokasi", container=col1)
+    col2.radio("Tipe", ["masuk", "keluar"], key="scan_tipe", horizontal=True,
+               format_func=lambda x: "✅ Masuk" if x == "masuk" else "❌ Keluar")
+    st.text_input("Scan Barcode / Kode / Nama Barang", key="scan_kode",
+                  on_change=handle_scan,
+                  placeholder="Arahkan scanner ke sini...")
+
+    feedback = st.session_state.pop("scan_feedback", None)
+    if feedback:
+        ok, message = feedback
+        if ok:
+            st.success(message)
+        else:
+            st.error(message)
+    if queue["error"]:
+        st.error(f"Gagal menyimpan antrian: {queue['error']}")
+
+    # Scan yang sedang ditulis belum tersimpan, jadi tetap ditampilkan
+    with queue["lock"]:
+        pending = dict(queue["pending"])
+        for key, jumlah in queue["in_flight"].items():
+            pending[key] = pending.get(key, 0) + jumlah
+        rejected = dict(queue["rejected"])
+    names = dict(get_db().execute("SELECT id, nama FROM items").fetchall())
+    locations = dict(get_db().execute(
+        "SELECT id, nama FROM locations").fetchall())
+    if rejected:
+        st.warning("\n".join(
+            f"- {names.get(item_id)} di {locations.get(location_id)}: "
+            f"{jumlah} scan keluar tidak tersimpan, stok tidak mencukupi"
+            for (location_id, item_id), jumlah in rejected.items()
+        ), icon="⚠️")
+        st.button("Tandai Sudah Dicek", on_click=acknowledge_scan_rejections,
+                  args=(queue,))
+    if pending:
+        st.dataframe(
+            to_arrow(compact_frame(pd.DataFrame(
+                [(names.get(item_id), locations.get(location_id), tipe, jumlah)
+                 for (location_id, item_id, tipe), jumlah in pending.items()],
+                columns=["nama", "lokasi", "tipe", "jumlah"]
+            ))),
+            column_config={
+                "nama": "Barang",
+                "lokasi": "Lokasi",
+                "tipe": "Tipe",
+                "jumlah": st.column_config.NumberColumn("Jumlah", format="%d")
+            },
+            hide_index=True,
+            use_container_width=True
+        )
+    else:
+        st.info("Antrian kosong, semua scan sudah tersimpan", icon="ℹ️")
+    st.button("Simpan Sekarang", type="primary",
+              on_click=flush_scan_queue, args=(queue,))
 
 # ==================================================================================
 # HALAMAN LAPORAN (DIPERBAIKI)
@@ -534,49 +1144,86 @@ def transaksi_page():
 def laporan_page():
     check_access(["superadmin", "admin", "user"])
     render_header()
+    jenis = st.radio("Jenis Laporan", ["Ringkasan Periode", "Kartu Stok"],
+                     horizontal=True, label_visibility="collapsed")
+    if jenis == "Kartu Stok":
+        kartu_stok_page()
+        return
 
     # Fungsi untuk menghasilkan laporan
-    def generate_report(items, start_date, end_date, aggregation):
-        date_format = {
-            "Harian": "%Y-%m-%d",
-            "Mingguan": "%Y-%U",
-            "Bulanan": "%Y-%m",
-            "Tahunan": "%Y"
-        }[aggregation]
+    def generate_report(conn, start_date, end_date, aggregation, location_id=None):
+        column = PERIOD_COLUMNS[aggregation][0]
+        # Semua lokasi: transfer antar lokasi saling meniadakan, jadi dilewati
+        if location_id is None:
+            location_filter = "AND transfer_id IS NULL"
+            location_params = ()
+        else:
+            location_filter = "AND location_id = ?"
+            location_params = (location_id,)
 
+        # Rentang kunci periode mempersempit scan indeks, filter tanggal
+        # tetap dipakai untuk periode yang terpotong di awal/akhir. Indeks
+        # periode dipaksa: tanpa itu filter lokasi membuat SQLite memilih
+        # idx_transactions_lokasi lalu GROUP BY lewat temp B-tree
         query = f"""
-            SELECT 
-                strftime('{date_format}', tanggal) AS periode,
+            SELECT
+                t.periode,
                 i.nama,
-                SUM(CASE WHEN tipe='masuk' THEN jumlah ELSE 0 END) AS total_masuk,
-                SUM(CASE WHEN tipe='keluar' THEN jumlah ELSE 0 END) AS total_keluar
-            FROM transactions 
-            JOIN items i ON transactions.item_id = i.id
-            WHERE tanggal BETWEEN ? AND ?
-            GROUP BY periode, i.nama
+                t.total_masuk,
+                t.total_keluar
+            FROM (
+                SELECT
+                    {column} AS periode,
+                    item_id,
+                    SUM(CASE WHEN tipe='masuk' THEN jumlah ELSE 0 END) AS total_masuk,
+                    SUM(CASE WHEN tipe='keluar' THEN jumlah ELSE 0 END) AS total_keluar
+                FROM transactions INDEXED BY idx_transactions_{column}
+                WHERE {column} BETWEEN ? AND ?
+                  AND tanggal BETWEEN ? AND ?
+                  {location_filter}
+                GROUP BY {column}, item_id
+            ) t
+            JOIN items i ON t.item_id = i.id
+            ORDER BY t.periode, i.nama
         """
-        return pd.read_sql(query, get_db(), params=(start_date, end_date))
+        return load_frame(query, conn, params=(
+            period_key(start_date, aggregation),
+            period_key(end_date, aggregation),
+            start_date,
+            end_date,
+            *location_params
+        ))
 
     # Filter dan kontrol
     st.subheader("Pengaturan Laporan")
-    col1, col2, col3 = st.columns(3)
-    items = pd.read_sql("SELECT nama FROM items", get_db())
-    selected_items = col1.multiselect("Filter Barang", items['nama'].unique())
-    aggregation = col2.selectbox(
-        "Aggregasi", ["Harian", "Mingguan", "Bulanan", "Tahunan"])
-
-    start_date = col3.date_input(
-        "Tanggal Mulai", datetime.now() - timedelta(days=30))
-    end_date = col3.date_input("Tanggal Akhir", datetime.now())
-
-    # Proses data
-    if selected_items:
-        filtered_items = ", ".join([f"'{item}'" for item in selected_items])
-        query_filter = f" AND i.nama IN ({filtered_items})"
-    else:
-        query_filter = ""
+    pinned = st.session_state.get("laporan_snapshot")
+    # Versi diambil sebelum membaca agar cache tidak menyimpan data lama
+    # dengan versi yang lebih baru
+    version = ("snapshot", pinned[1]) if pinned else data_version()
+    with read_snapshot(pinned) as (conn, snapshot_at):
+        col1, col2, col3 = st.columns(3)
+        items = load_frame("SELECT nama FROM items", conn)
+        selected_items = col1.multiselect("Filter Barang", items['nama'].unique())
+        aggregation = col2.selectbox(
+            "Aggregasi", ["Harian", "Mingguan", "Bulanan", "Tahunan"])
+        location_id = select_location(
+            "Lokasi", container=col2, include_all=True, conn=conn)
+
+        start_date = col3.date_input(
+            "Tanggal Mulai", datetime.now() - timedelta(days=30))
+        end_date = col3.date_input("Tanggal Akhir", datetime.now())
+
+        # Proses data
+        if selected_items:
+            filtered_items = ", ".join([f"'{item}'" for item in selected_items])
+            query_filter = f" AND i.nama IN ({filtered_items})"
+        else:
+            query_filter = ""
 
-    df = generate_report(items, start_date, end_date, aggregation)
+        df = generate_report(conn, start_date, end_date,
+                             aggregation, location_id)
+
+    snapshot_pin_control(snapshot_at)
 
     # Tampilkan hasil
     if not df.empty:
@@ -590,43 +1237,55 @@ def laporan_page():
         col3.metric("Net Perubahan", f"{total_masuk - total_keluar} item")
 
         # Chart interaktif
-        fig = px.line(df,
-                      x='periode',
-                      y=['total_masuk', 'total_keluar'],
-                      color='nama',
-                      title='Tren Stok',
-                      labels={
-                          'periode': 'Periode',
-                          'value': 'Jumlah'
-                      })
-        fig.update_layout(hovermode='x unified')
+        def build_chart():
+            fig = px.line(df,
+                          x='periode',
+                          y=['total_masuk', 'total_keluar'],
+                          color='nama',
+                          title='Tren Stok',
+                          labels={
+                              'periode': 'Periode',
+                              'value': 'Jumlah'
+                          })
+            fig.update_layout(hovermode='x unified')
+            return fig
+
+        report_key = (start_date, end_date, aggregation, location_id)
+        fig = cached_render("laporan_chart", report_key, build_chart,
+                            version)
         st.plotly_chart(fig, use_container_width=True)
 
         # Tabel detail
         st.subheader("Data Detail")
-        gb = GridOptionsBuilder.from_dataframe(df)
-        gb.configure_pagination(paginationPageSize=10)
-        gb.configure_side_bar()
-        gb.configure_default_column(
-            resizable=True,
-            filterable=True,
-            sortable=True,
-            autoHeight=True,
-            flex=1  # Auto-expand columns
-        )
-        # Konfigurasi kolom spesifik
-        gb.configure_column(
-            "periode", header_name="Periode", minWidth=150, flex=1)
-        gb.configure_column("nama", header_name="Barang", minWidth=200, flex=2)
-        gb.configure_column("total_masuk", header_name="Total Masuk",
-                            type=["numericColumn"], minWidth=150, flex=1)
-        gb.configure_column("total_keluar", header_name="Total Keluar",
-                            type=["numericColumn"], minWidth=150, flex=1)
-
-        gridOptions = gb.build()
-        gridOptions['domLayout'] = 'autoHeight'  # Auto height
-        # Auto-fit columns
-        gridOptions['onGridReady'] = 'function(params) { params.api.sizeColumnsToFit(); }'
+        def build_grid():
+            gb = GridOptionsBuilder.from_dataframe(df)
+            gb.configure_pagination(paginationPageSize=10)
+            gb.configure_side_bar()
+            gb.configure_default_column(
+                resizable=True,
+                filterable=True,
+                sortable=True,
+                autoHeight=True,
+                flex=1  # Auto-expand columns
+            )
+            # Konfigurasi kolom spesifik
+            gb.configure_column(
+                "periode", header_name="Periode", minWidth=150, flex=1)
+            gb.configure_column("nama", header_name="Barang", minWidth=200, flex=2)
+            gb.configure_column("total_masuk", header_name="Total Masuk",
+                                type=["numericColumn"], minWidth=150, flex=1)
+            gb.configure_column("total_keluar", header_name="Total Keluar",
+                                type=["numericColumn"], minWidth=150, flex=1)
+
+            gridOptions = gb.build()
+            gridOptions['domLayout'] = 'autoHeight'  # Auto height
+            # Auto-fit columns
+            gridOptions['onGridReady'] = 'function(params) { params.api.sizeColumnsToFit(); }'
+            return gridOptions
+
+        # AgGrid boleh mengubah gridOptions, jadi yang dipakai salinannya
+        gridOptions = copy.deepcopy(cached_render(
+            "laporan_grid", report_key, build_grid, version))
 
         AgGrid(
             df,
@@ -655,6 +1314,311 @@ def laporan_page():
         st.warning("Tidak ada data untuk parameter yang dipilih")
 
 
+STOCK_CARD_PAGE_SIZE = 50
+
+
+def stock_card_query(location_id, limit=True):
+    # Saldo berjalan dihitung SQLite dengan window function. Keyset dan LIMIT
+    # diterapkan lebih dulu di subquery lewat indeks (item_id, tanggal, id),
+    # lalu saldo sebelum halaman dibawa oleh cursor (tanggal, id, saldo)
+    # sehingga setiap halaman hanya membaca barisnya sendiri. Indeks itu
+    # dipaksa: dengan filter lokasi SQLite memilih idx_transactions_lokasi dan
+    # menyusuri mutasi semua barang di lokasi tersebut
+    if location_id is None:
+        location_filter = "AND transfer_id IS NULL"
+    else:
+        location_filter = "AND location_id = :location_id"
+    return f"""
+        SELECT
+            p.id,
+            p.tanggal,
+            p.tanggal AS cursor_tanggal,
+            l.nama AS lokasi,
+            p.tipe,
+            p.jumlah,
+            p.keterangan,
+            :saldo + SUM(CASE WHEN p.tipe='masuk' THEN p.jumlah ELSE -p.jumlah END)
+                OVER (PARTITION BY p.item_id ORDER BY p.tanggal, p.id
+                      ROWS UNBOUNDED PRECEDING) AS saldo
+        FROM (
+            SELECT id, item_id, tanggal, tipe, jumlah, keterangan, location_id
+            FROM transactions INDEXED BY idx_transactions_item_tanggal
+            WHERE item_id = :item_id
+              AND (tanggal, id) > (:tanggal, :id)
+              {location_filter}
+            ORDER BY tanggal, id
+            {"LIMIT :limit" if limit else ""}
+        ) p
+        JOIN locations l ON p.location_id = l.id
+        ORDER BY p.tanggal, p.id
+    """
+
+
+def stock_card_opening(conn, item_id, location_id):
+    # Saldo awal = stok saat ini dikurangi seluruh mutasi yang tercatat
+    c = conn.cursor()
+    if location_id is None:
+        c.execute("SELECT stok FROM items WHERE id=?", (item_id,))
+        row = c.fetchone()
+        stok = row[0] if row else 0
+        location_filter, params = "AND transfer_id IS NULL", (item_id,)
+    else:
+        stok = get_location_stock(c, item_id, location_id)
+        location_filter, params = "AND location_id = ?", (item_id, location_id)
+    c.execute(f"""
+        SELECT COALESCE(SUM(CASE WHEN tipe='masuk' THEN jumlah ELSE -jumlah END), 0)
+        FROM transactions
+        WHERE item_id = ? {location_filter}
+    """, params)
+    return stok - c.fetchone()[0]
+
+
+def kartu_stok_page():
+    st.subheader("Kartu Stok")
+    # Daftar barang/lokasi, saldo awal, dan halaman dibaca dari snapshot yang
+    # sama; kontrol kunci tampil lebih dulu agar selalu bisa dilepas
+    with read_snapshot(st.session_state.get("laporan_snapshot")) as (conn, snapshot_at):
+        snapshot_pin_control(snapshot_at)
+        col1, col2 = st.columns(2)
+        items = load_frame("SELECT id, nama FROM items ORDER BY nama", conn)
+        if items.empty:
+            st.warning("Tidak ada data barang")
+            return
+        names = dict(zip(items['id'].tolist(), items['nama']))
+        item_id = col1.selectbox("Barang", list(names),
+                                 format_func=lambda x: names[x])
+        location_id = select_location("Lokasi", container=col2,
+                                      include_all=True, conn=conn)
+
+        # Tumpukan cursor per (barang, lokasi); cursor[k] = akhir halaman k-1
+        state_key = (item_id, location_id)
+        if st.session_state.get("kartu_stok_key") != state_key:
+            opening = stock_card_opening(conn, item_id, location_id)
+            st.session_state.kartu_stok_key = state_key
+            st.session_state.kartu_stok_cursors = [("", 0, opening)]
+        cursors = st.session_state.kartu_stok_cursors
+        tanggal, last_id, saldo = cursors[-1]
+
+        df = load_frame(stock_card_query(location_id), conn, params={
+            "item_id": item_id,
+            "location_id": location_id,
+            "tanggal": tanggal,
+            "id": last_id,
+            "saldo": saldo,
+            "limit": STOCK_CARD_PAGE_SIZE + 1
+        })
+    has_next = len(df) > STOCK_CARD_PAGE_SIZE
+    df = df.head(STOCK_CARD_PAGE_SIZE)
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Saldo Awal", cursors[0][2])
+    col2.metric("Saldo Awal Halaman", saldo)
+    col3.metric("Saldo Akhir Halaman",
+                int(df['saldo'].iloc[-1]) if not df.empty else saldo)
+    st.caption(f"Halaman {len(cursors)}")
+
+    if df.empty:
+        st.info("Belum ada mutasi untuk barang ini", icon="ℹ️")
+    else:
+        df['status'] = df['tipe'].map(
+            {"masuk": "✅ Masuk", "keluar": "❌ Keluar"}).astype("category")
+        st.dataframe(
+            to_arrow(df[['tanggal', 'lokasi', 'status',
+                     'jumlah', 'saldo', 'keterangan']]),
+            column_config={
+                "tanggal": st.column_config.DateColumn("Tanggal", format="DD MMM YYYY"),
+                "lokasi": st.column_config.TextColumn("Lokasi"),
+                "status": st.column_config.TextColumn("Status"),
+                "jumlah": st.column_config.NumberColumn("Jumlah", format="%d"),
+                "saldo": st.column_config.NumberColumn("Saldo", format="%d"),
+                "keterangan": st.column_config.TextColumn("Keterangan")
+            },
+            hide_index=True,
+            use_container_width=True
+        )
+
+    col1, col2, col3 = st.columns(3)
+    if col1.button("◀ Sebelumnya", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+    if col2.button("Berikutnya ▶", disabled=not has_next):
+        last = df.iloc[-1]
+        cursors.append((last['cursor_tanggal'],
+                        int(last['id']), int(last['saldo'])))
+        st.rerun()
+    if col3.button("Export Kartu Stok ke CSV"):
+        # Nama barang bebas (bisa berisi "/" atau ".."): hanya karakter aman
+        # yang dipakai, id barang menjaga nama file tetap unik
+        slug = re.sub(r"[^0-9A-Za-z]+", "_", names[item_id]).strip("_")
+        filename = f"kartu_stok_{item_id}_{slug}.csv"
+        with read_snapshot(st.session_state.get("laporan_snapshot")) as (conn, _):
+            chunks = load_frame(stock_card_query(location_id, limit=False), conn, params={
+                "item_id": item_id,
+                "location_id": location_id,
+                "tanggal": "",
+                "id": 0,
+                "saldo": cursors[0][2]
+            }, chunksize=10_000)
+            with open(filename, "w", newline="") as f:
+                for i, chunk in enumerate(chunks):
+                    chunk.drop(columns="cursor_tanggal").to_csv(
+                        f, header=i == 0, index=False)
+        st.success(f"File {filename} berhasil dibuat!")
+
+
+# ==================================================================================
+# EKSPOR & IMPOR PARQUET
+# ==================================================================================
+
+
+PARQUET_ROW_GROUP_SIZE = 100_000
+# Kolom yang diekspor per tabel (password user tidak pernah ikut)
+PARQUET_TABLES = {
+    "locations": pa.schema([("id", pa.int64()), ("nama", pa.string())]),
+    "items": pa.schema([
+        ("id", pa.int64()),
+        ("nama", pa.string()),
+        ("stok", pa.int64()),
+        ("satuan", pa.string()),
+        ("keterangan", pa.string()),
+        ("kode", pa.string())
+    ]),
+    "stock_balances": pa.schema([
+        ("location_id", pa.int64()),
+        ("item_id", pa.int64()),
+        ("stok", pa.int64())
+    ]),
+    "transactions": pa.schema([
+        ("id", pa.int64()),
+        ("item_id", pa.int64()),
+        ("tipe", pa.string()),
+        ("jumlah", pa.int64()),
+        ("tanggal", pa.string()),
+        ("keterangan", pa.string()),
+        ("location_id", pa.int64()),
+        ("transfer_id", pa.int64())
+    ]),
+    "users": pa.schema([
+        ("id", pa.int64()),
+        ("username", pa.string()),
+        ("role", pa.string())
+    ])
+}
+
+
+def write_parquet(path, schema, cursor):
+    # Dibaca bertahap dari cursor; setiap batch menjadi satu row group
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    total = 0
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        while True:
+            rows = cursor.fetchmany(PARQUET_ROW_GROUP_SIZE)
+            if not rows:
+                break
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(column, type=field.type)
+                 for column, field in zip(zip(*rows), schema)],
+                schema=schema
+            ))
+            total += len(rows)
+    return total
+
+
+def export_parquet(target_dir):
+    counts = {}
+    with read_snapshot() as (conn, snapshot_at):
+        for table, schema in PARQUET_TABLES.items():
+            columns = ", ".join(schema.names)
+            if table != "transactions":
+                cursor = conn.execute(
+                    f"SELECT {columns} FROM {table} ORDER BY 1, 2")
+                counts[table] = write_parquet(
+                    os.path.join(target_dir, f"{table}.parquet"), schema, cursor)
+                continue
+            # Transaksi dipartisi per tahun (gaya hive: tahun=YYYY)
+            counts[table] = 0
+            years = [row[0] for row in conn.execute(
+                "SELECT DISTINCT periode_tahun FROM transactions ORDER BY periode_tahun")]
+            for year in years:
+                cursor = conn.execute(
+                    f"SELECT {columns} FROM transactions WHERE periode_tahun IS ? ORDER BY id",
+                    (year,))
+                partition = f"tahun={year or '__HIVE_DEFAULT_PARTITION__'}"
+                counts[table] += write_parquet(
+                    os.path.join(target_dir, table, partition, "part-0.parquet"),
+                    schema, cursor)
+            if not years:
+                # Ledger kosong tetap punya dataset transaksi (0 baris, dengan
+                # skema) agar hasil ekspor bisa di-restore
+                write_parquet(os.path.join(target_dir, table, "part-0.parquet"),
+                              schema, conn.execute(f"SELECT {columns} FROM transactions"))
+    return counts, snapshot_at
+
+
+def import_parquet(source_dir, target_path, superadmin_password):
+    if os.path.exists(target_path):
+        raise FileExistsError(f"File {target_path} sudah ada")
+    conn = sqlite3.connect(target_path)
+    try:
+        # Database baru: tanpa journal selama pemuatan, indeks dibuat ulang
+        # setelah semua data masuk
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        init_db(conn)
+        # superadmin dibuat init_db; password default tidak boleh ikut ke
+        # database hasil restore
+        conn.execute("UPDATE users SET password=? WHERE username='superadmin'",
+                     (superadmin_password,))
+        indexes = conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='index' AND name LIKE 'idx_%'").fetchall()
+        for (name,) in indexes:
+            conn.execute(f"DROP INDEX {name}")
+
+        counts = {}
+        for table, schema in PARQUET_TABLES.items():
+            if table == "transactions":
+                path = os.path.join(source_dir, table)
+                if not os.path.isdir(path):
+                    # Ekspor lama dari ledger kosong tidak menulis folder ini
+                    counts[table] = 0
+                    continue
+            else:
+                path = os.path.join(source_dir, f"{table}.parquet")
+            columns = schema.names
+            if table == "users":
+                # Password tidak diekspor: user hasil restore mendapat password
+                # acak dan harus di-reset superadmin. id tidak dipakai tabel
+                # lain, jadi dibuat ulang agar tidak bentrok dengan superadmin
+                columns = ["username", "role", "password"]
+                verb = "INSERT"
+            elif table == "locations":
+                verb = "INSERT OR REPLACE"
+            else:
+                verb = "INSERT"
+            sql = f"{verb} INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+            before = conn.total_changes
+            dataset = ds.dataset(path, format="parquet", partitioning="hive")
+            for batch in dataset.to_batches(columns=schema.names,
+                                            batch_size=PARQUET_ROW_GROUP_SIZE):
+                rows = zip(*(column.to_pylist() for column in batch.columns))
+                if table == "users":
+                    rows = ((username, role, secrets.token_urlsafe(16))
+                            for _, username, role in rows
+                            if username != "superadmin")
+                conn.executemany(sql, rows)
+            # Dihitung dari baris yang benar-benar ditulis SQLite
+            counts[table] = conn.total_changes - before
+        conn.commit()
+        init_db(conn)
+        conn.execute("PRAGMA journal_mode=WAL")
+    except Exception:
+        conn.close()
+        os.remove(target_path)
+        raise
+    conn.close()
+    return counts
+
+
 # ==================================================================================
 # HALAMAN PENGGATURAN (DIPERBAIKI)
 # ==================================================================================
@@ -662,9 +1626,11 @@ def pengaturan_page():
     check_access(["superadmin"])
     render_header()
 
-    tab1, tab2 = st.tabs([
+    tab1, tab2, tab3, tab4 = st.tabs([
         "🔑 Ubah Password",
-        "👥 Manajemen User"
+        "👥 Manajemen User",
+        "📍 Lokasi Gudang",
+        "🗄️ Backup Parquet"
     ])
 
     # =====================================
@@ -719,7 +1685,7 @@ def pengaturan_page():
     # =====================================
     with tab2:
         st.subheader("Manajemen Pengguna")
-        user_list = pd.read_sql(
+        user_list = load_frame(
             "SELECT * FROM users WHERE role != 'superadmin'", get_db())
 
         # Mode operasi
@@ -806,6 +1772,110 @@ def pengaturan_page():
                             st.error(
                                 "Centang kotak konfirmasi untuk menghapus")
 
+    # =====================================
+    # TAB LOKASI GUDANG
+    # =====================================
+    with tab3:
+        st.subheader("Lokasi Gudang")
+        locations = load_frame("""
+            SELECT l.id, l.nama, COUNT(b.item_id) AS jumlah_barang,
+                   COALESCE(SUM(b.stok), 0) AS total_stok
+            FROM locations l
+            LEFT JOIN stock_balances b ON b.location_id = l.id AND b.stok > 0
+            GROUP BY l.id, l.nama
+            ORDER BY l.id
+        """, get_db())
+        st.dataframe(
+            to_arrow(locations),
+            column_config={
+                "id": None,
+                "nama": "Lokasi",
+                "jumlah_barang": st.column_config.NumberColumn("Jenis Barang", format="%d"),
+                "total_stok": st.column_config.NumberColumn("Total Stok", format="%d")
+            },
+            hide_index=True,
+            use_container_width=True
+        )
+        with st.form("tambah_lokasi_form", border=True):
+            st.markdown("### Tambah Lokasi Baru")
+            nama_lokasi = st.text_input(
+                "Nama Lokasi*", placeholder="Contoh: Gudang Cabang Bandung")
+            if st.form_submit_button("Tambah Lokasi", type="primary", use_container_width=True):
+                if not nama_lokasi.strip():
+                    st.error("Nama lokasi wajib diisi!")
+                else:
+                    try:
+                        conn = get_db()
+                        conn.cursor().execute(
+                            "INSERT INTO locations (nama) VALUES (?)", (nama_lokasi.strip(),))
+                        conn.commit()
+                        st.success(
+                            f"Lokasi {nama_lokasi} berhasil ditambahkan!")
+                    except sqlite3.IntegrityError:
+                        st.error("Nama lokasi sudah ada!")
+                    except Exception as e:
+                        st.error(f"Error: {str(e)}")
+
+    # =====================================
+    # TAB BACKUP PARQUET
+    # =====================================
+    with tab4:
+        st.subheader("Ekspor Ledger ke Parquet")
+        st.caption(
+            "Barang, lokasi, saldo, transaksi (dipartisi per tahun) dan user "
+            "tanpa password, dibaca dari satu snapshot.")
+        if st.button("Export Parquet", type="primary"):
+            target_dir = os.path.join(
+                "export_parquet", datetime.now().strftime("%Y%m%d_%H%M%S"))
+            try:
+                counts, snapshot_at = export_parquet(target_dir)
+                st.session_state.parquet_dir = target_dir
+                st.success(
+                    f"Export selesai ke {target_dir} "
+                    f"(snapshot {snapshot_at:%d %b %Y %H:%M:%S})")
+                st.dataframe(
+                    pd.DataFrame(counts.items(), columns=["tabel", "baris"]),
+                    hide_index=True
+                )
+            except Exception as e:
+                st.error(f"Error: {str(e)}")
+
+        with st.form("restore_parquet_form", border=True):
+            st.markdown("### Restore ke Database Baru")
+            source_dir = st.text_input(
+                "Folder Parquet*", value=st.session_state.get("parquet_dir", ""))
+            target_path = st.text_input(
+                "File Database Tujuan*", value="database_restore.db")
+            superadmin_password = st.text_input(
+                "Password Superadmin Baru*", type="password",
+                help="Password tidak ikut diekspor; superadmin di database hasil restore memakai password ini")
+            konfirmasi = st.text_input(
+                "Konfirmasi Password*", type="password")
+            if st.form_submit_button("Restore", type="primary", use_container_width=True):
+                if not source_dir or not target_path or not superadmin_password:
+                    st.error("Semua field wajib diisi!")
+                elif not os.path.isdir(source_dir):
+                    st.error("Folder Parquet tidak ditemukan!")
+                elif len(superadmin_password) < 8:
+                    st.error("Password superadmin minimal 8 karakter")
+                elif superadmin_password != konfirmasi:
+                    st.error("Konfirmasi password tidak cocok")
+                else:
+                    try:
+                        counts = import_parquet(source_dir, target_path,
+                                                superadmin_password)
+                        st.success(
+                            f"Restore selesai ke {target_path}. Ganti {DB_PATH} dengan "
+                            "file ini saat aplikasi berhenti. Password user selain "
+                            "superadmin perlu di-reset.")
+                        st.dataframe(
+                            pd.DataFrame(counts.items(),
+                                         columns=["tabel", "baris"]),
+                            hide_index=True
+                        )
+                    except Exception as e:
+                        st.error(f"Error: {str(e)}")
+
 
 # ==================================================================================
 # FUNGSI PEMBANTU